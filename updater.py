@@ -1,7 +1,7 @@
 import requests
 import os
 import time
-from shutil import unpack_archive
+from shutil import copyfileobj, unpack_archive
 
 # Constants
 MANIFEST_URL = "https://raw.githubusercontent.com/ariessunfeld/raman-spectroscopy/main/manifest.json"
@@ -31,9 +31,9 @@ def main():
         if choice == 'y':
             # Download and extract new version
             response = requests.get(download_url, stream=True)
+            response.raw.decode_content = True # Undo any gzip transfer encoding, as iter_content did
             with open("temp_update.zip", 'wb') as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
+                copyfileobj(response.raw, file, length=1 << 20)
             time.sleep(1)
             unpack_archive("temp_update.zip", remote_version)
             os.remove("temp_update.zip")
@@ -20,14 +20,20 @@ class Command:
 
 
 class CommandSpectrum:
-    """Represents a Spectrum for Command classes"""
+    """Represents a Spectrum for Command classes
+
+    The x and y arrays are made read-only. Commands always build new arrays rather than
+    editing existing ones, so snapshots can share them instead of copying.
+    """
     def __init__(self, x, y):
-        self.x = x
-        self.y = y
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.x.flags.writeable = False
+        self.y.flags.writeable = False
 
     def copy(self):
-        """Deep copy"""
-        return CommandSpectrum(self.x.copy(), self.y.copy())
+        """Snapshot (shares the read-only arrays)"""
+        return CommandSpectrum(self.x, self.y)
 
     def __iter__(self):
         return [self.x, self.y].__iter__()
@@ -235,9 +241,9 @@ class CropCommand(Command):
         self.new_spectrum = self._get_cropped_spectrum()
 
     def _get_cropped_spectrum(self):
-        indices_to_crop = np.where((self.old_spectrum.x >= self.crop_start_x) & (self.old_spectrum.x <= self.crop_end_x))
+        mask = (self.old_spectrum.x >= self.crop_start_x) & (self.old_spectrum.x <= self.crop_end_x)
         new_y = self.old_spectrum.y.copy()
-        new_y[indices_to_crop] = np.nan
+        np.putmask(new_y, mask, np.nan)
         return CommandSpectrum(self.old_spectrum.x, new_y)
 
     def execute(self):
@@ -14,6 +14,12 @@ class DraggableScatter(pg.ScatterPlotItem):
         super().__init__(*args, **kwargs)
         self.draggedPointIndex = None
         self.startPos = None
+        # Drag moves update self.data immediately, but the redraw and pointDragged are
+        # coalesced to at most one per frame (~60 Hz) instead of one per mouse move
+        self.dragUpdateTimer = QtCore.QTimer(self)
+        self.dragUpdateTimer.setSingleShot(True)
+        self.dragUpdateTimer.setInterval(16)
+        self.dragUpdateTimer.timeout.connect(self.flushDragUpdate)
 
     def mousePressEvent(self, ev):
         if ev.button() == QtCore.Qt.MouseButton.LeftButton:
@@ -32,13 +38,23 @@ class DraggableScatter(pg.ScatterPlotItem):
             pos = ev.pos()
             self.data['x'][self.draggedPointIndex] = pos.x()
             self.data['y'][self.draggedPointIndex] = pos.y()
-            self.setData(x=self.data['x'], y=self.data['y'])
-            self.pointDragged.emit()
+            if ev.isFinish():
+                self.flushDragUpdate()
+            elif not self.dragUpdateTimer.isActive():
+                self.dragUpdateTimer.start()
         ev.accept()
 
+    def flushDragUpdate(self):
+        """Redraws the points and emits pointDragged for any pending drag moves"""
+        self.dragUpdateTimer.stop()
+        self.setData(x=self.data['x'], y=self.data['y'])
+        self.pointDragged.emit()
+
     def mouseReleaseEvent(self, ev):
         print('mouseReleaseEvent occurred')
         if self.draggedPointIndex is not None:
+            if self.dragUpdateTimer.isActive():
+                self.flushDragUpdate() # Draw the final position before reporting it
             endPos = (self.data['x'][self.draggedPointIndex], self.data['y'][self.draggedPointIndex])
             self.dragFinished.emit(self.draggedPointIndex, *self.startPos, *endPos)
             print('Emitted drafFinished signal')
@@ -52,10 +68,10 @@ class DraggableGraph(pg.GraphItem):
         super().__init__()
         self.scatter_data = scatter_data
         self.graph_data = {
-            'adj': np.array([[i, i+1] for i in range(len(scatter_data['x'])-1)], dtype=np.int32),
+            'adj': np.column_stack((np.arange(len(scatter_data['x'])-1), np.arange(1, len(scatter_data['x'])))).astype(np.int32),
             'pen': pg.mkPen('r')
         }
-        self.setData(pos=np.array(list(zip(self.scatter_data['x'], self.scatter_data['y']))), adj=self.graph_data['adj'], pen=self.graph_data['pen'])
+        self.setData(pos=np.column_stack((self.scatter_data['x'], self.scatter_data['y'])), adj=self.graph_data['adj'], pen=self.graph_data['pen'])
 
 
 ### ============================
@@ -90,7 +106,7 @@ class MainApp(QMainWindow):
         self.show()
 
     def updateGraph(self):
-        self.graph.setData(pos=np.array(list(zip(self.scatter.data['x'], self.scatter.data['y']))))
+        self.graph.setData(pos=np.column_stack((self.scatter.data['x'], self.scatter.data['y'])))
 
 
 if __name__ == '__main__':
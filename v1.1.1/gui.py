@@ -4,7 +4,8 @@ import os
 import sys
 from pathlib import Path
 import json
-import threading
+from collections import OrderedDict
+from functools import partial
 
 from PyQt6.QtWidgets import QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QSizePolicy
 from PyQt6.QtWidgets import QLabel, QLineEdit, QPushButton, QTextEdit, QGridLayout, QDialog
@@ -13,12 +14,18 @@ from PyQt6 import QtCore
 from PyQt6.QtGui import QColor, QShortcut, QKeySequence
 from PyQt6.QtCore import pyqtSignal
 import pyqtgraph as pg
+try: # pyqtgraph's OpenGL viewport needs both Qt's OpenGL widgets and PyOpenGL
+    from PyQt6.QtOpenGLWidgets import QOpenGLWidget
+    import OpenGL
+    OPENGL_AVAILABLE = True
+except ImportError:
+    OPENGL_AVAILABLE = False
 
 import numpy as np
-import sqlite3
 
-from utils import find_spectrum_matches, get_unique_mineral_combinations_optimized
-from utils import get_xy_from_file, deserialize, baseline_als, get_peaks
+from utils import find_unique_mineral_combinations
+from utils import get_xy_from_file, deserialize, baseline_als, baseline_als_downsampled, get_peaks
+from utils import fetch_spectra_by_name, fetch_spectrum_data, prepare_database, close_connections
 
 from discretize import DraggableGraph, DraggableScatter
 from spectra import Spectrum
@@ -26,6 +33,19 @@ from plots import CroppablePlotWidget
 from commands import CommandHistory, LoadSpectrumCommand, PointDragCommand
 from commands import CommandSpectrum, EstimateBaselineCommand, CorrectBaselineCommand
 from commands import CropCommand
+from workers import Worker
+
+MAX_PEAK_LABELS = 15 # Peak labels are drawn for at most this many of the tallest peaks
+
+def parse_optional_number(text, allow_range=False):
+    """Parses a textbox value into a float, or None if it is blank.
+    If `allow_range`, a comma-separated pair like `1,5`, `(1, 5)` or `[1, 5]` gives a tuple of floats"""
+    text = text.strip().strip('()[]')
+    if not text:
+        return None
+    if allow_range and ',' in text:
+        return tuple(float(part) for part in text.split(','))
+    return float(text)
 
 class MainApp(QMainWindow):
     def __init__(self):
@@ -38,19 +58,37 @@ class MainApp(QMainWindow):
         self.spectrum = None
         self.cropping = False
         self.crop_region = None
+        self.deserialized_spectra = OrderedDict() # filename -> (x, y) arrays of recently plotted database spectra, oldest first
+        self.plot2_curves = [] # Curves on plot2, reused by plot_selected_spectra
+        self.match_results = OrderedDict() # (database path, unique peaks, tolerance, search options) -> results of recent peak searches, oldest first
         with open('config.json', 'r') as f:
             self.config = json.load(f)
+        self.plot_widths_pending = False
         self.init_UI()
-        current_size = self.size()
-        self.resize(current_size.width() + 1, current_size.height())
-        self.resize(current_size.width(), current_size.height())
+        self.init_plot_size_policies()
+        QtCore.QTimer.singleShot(0, self._equalize_plot_widths) # Once the window has been laid out
         self.init_keyboard_shortcuts()
         self.command_history = CommandHistory()
 
+    def closeEvent(self, event):
+        """Close the database connections on exit, unless a running search may still be using them"""
+        pool = QtCore.QThreadPool.globalInstance()
+        pool.clear() # Drop queued workers that haven't started
+        if pool.waitForDone(500): # Milliseconds; don't freeze the window on a long search
+            close_connections()
+        super().closeEvent(event)
+
     def resizeEvent(self, event):
+        super().resizeEvent(event)
+        # Equalize the plot widths after the layout has handled the resize, once per batch of
+        # resize events rather than re-entering the event loop from inside this handler
+        if not self.plot_widths_pending:
+            self.plot_widths_pending = True
+            QtCore.QTimer.singleShot(0, self._equalize_plot_widths)
+
+    def _equalize_plot_widths(self):
         """Somewhat hacky but functional fix to the plot1.width != plot2.width problem"""
-        # Let the resizing occur
-        QApplication.processEvents()
+        self.plot_widths_pending = False
 
         # Get the maximum width of the two plot widgets
         max_width = max(self.plot1.width(), self.plot2.width())
@@ -59,7 +97,8 @@ class MainApp(QMainWindow):
         self.plot1.setMinimumWidth(max_width)
         self.plot2.setMinimumWidth(max_width)
 
-        # Additionally, set their size policy to be Preferred for width, so they try to maintain this width
+    def init_plot_size_policies(self):
+        # Set the plots' size policy to be Preferred for width, so they try to maintain the width set by _equalize_plot_widths
         policy1 = self.plot1.sizePolicy()
         policy1.setHorizontalPolicy(QSizePolicy.Policy.Preferred)
         policy1.setVerticalPolicy(QSizePolicy.Policy.Preferred)
@@ -70,9 +109,6 @@ class MainApp(QMainWindow):
         policy2.setVerticalPolicy(QSizePolicy.Policy.Preferred)
         self.plot2.setSizePolicy(policy2)
 
-        # Make sure to call the base class' method to ensure the event is handled properly
-        super().resizeEvent(event)
-
     def show_whats_new(self):
         # Load the new features from whats_new.py
         try:
@@ -94,26 +130,20 @@ class MainApp(QMainWindow):
             pass  # If whats_new.py is not found, just skip showing the messages
 
     def init_keyboard_shortcuts(self):
-        undo_shortcut = QShortcut(QKeySequence('Ctrl+Z'), self)
-        undo_shortcut.activated.connect(self.undo)
-
-        redo_shortcut = QShortcut(QKeySequence('Ctrl+Shift+Z'), self)
-        redo_shortcut.activated.connect(self.redo)
-
-        load_spectrum_shortcut = QShortcut(QKeySequence('Ctrl+L'), self)
-        load_spectrum_shortcut.activated.connect(self.load_unknown_spectrum)
-
-        crop_shortcut = QShortcut(QKeySequence('Ctrl+R'), self)
-        crop_shortcut.activated.connect(self.toggle_crop_mode)
-
-        baseline_shortcut = QShortcut(QKeySequence('Ctrl+E'), self)
-        baseline_shortcut.activated.connect(self.baseline_callback)
-
-        discretize_shortcut = QShortcut(QKeySequence('Ctrl+D'), self)
-        discretize_shortcut.activated.connect(self.discretize_baseline)
-
-        save_shortcut = QShortcut(QKeySequence('Ctrl+S'), self)
-        save_shortcut.activated.connect(self.save_edited_spectrum)
+        shortcuts = {
+            'Ctrl+Z': self.undo,
+            'Ctrl+Shift+Z': self.redo,
+            'Ctrl+L': self.load_unknown_spectrum,
+            'Ctrl+R': self.toggle_crop_mode,
+            'Ctrl+E': self.baseline_callback,
+            'Ctrl+D': self.discretize_baseline,
+            'Ctrl+S': self.save_edited_spectrum,
+        }
+        for keys, slot in shortcuts.items():
+            shortcut = QShortcut(QKeySequence(keys), self)
+            # Scope to this widget's subtree so Qt only checks it for key events here
+            shortcut.setContext(QtCore.Qt.ShortcutContext.WidgetWithChildrenShortcut)
+            shortcut.activated.connect(slot)
         
     def undo(self):
         print('Undo activated')
@@ -212,6 +242,10 @@ class MainApp(QMainWindow):
         self.plot1 = CroppablePlotWidget(self)
         self.plot1.setLabel('left', 'Intensity')
         self.plot1.setLabel('bottom', 'Raman Shift', units='cm<sup>-1</sup>')
+        # Decimate dense curves to about one min/max pair per pixel and skip off-screen points;
+        # applies to every curve later plotted on this widget
+        self.plot1.setDownsampling(auto=True, mode='peak')
+        self.plot1.setClipToView(True)
         plot1_layout.addWidget(self.plot1, 0, 0, 1, 2)
 
         # Button: load spectrum
@@ -302,6 +336,12 @@ class MainApp(QMainWindow):
         self.plot2 = pg.PlotWidget(self)
         self.plot2.setLabel('left', 'Intensity')
         self.plot2.setLabel('bottom', 'Raman Shift', units='cm<sup>-1</sup>')
+        self.plot2.setDownsampling(auto=True, mode='peak')
+        self.plot2.setClipToView(True)
+        if OPENGL_AVAILABLE and self.config.get('use OpenGL', False):
+            # Render both plots through OpenGL (opt-in; only when the system supports it)
+            self.plot1.useOpenGL(True)
+            self.plot2.useOpenGL(True)
         plot2_layout.addWidget(self.plot2, 0, 0, 1, 2)
         
         # LineEdit: mineral name
@@ -364,10 +404,11 @@ class MainApp(QMainWindow):
         fname, _ = QFileDialog.getSaveFileName(self, "Save Spectrum", str(suggested_path), "Text Files (*.txt);;All Files (*)")
 
         if fname:  # Check if user didn't cancel the dialog
-            with open(fname, 'w') as f:
-                for x, y in zip(self.spectrum.x, self.spectrum.y):
-                    f.write(f"{x} {y}\n")
-            
+            # Build the file contents in memory and write them in one call. Formatting Python
+            # floats is cheaper than NumPy scalars and gives the same shortest round-trip text
+            lines = [f"{x} {y}\n" for x, y in zip(self.spectrum.x.tolist(), self.spectrum.y.tolist())]
+            Path(fname).write_text(''.join(lines))
+
             self.plot1_log.addItem(f'Saved edited spectrum to: {fname}')
 
     def apply_crop(self):
@@ -388,11 +429,14 @@ class MainApp(QMainWindow):
 
     def update_discretized_baseline(self):
         """Updates the baseline data of the loaded spectrum whenever user moves a point after discretization"""
-        self.draggableGraph.setData(pos=np.array(list(zip(self.draggableScatter.data['x'], self.draggableScatter.data['y']))))
-        self.baseline_data = np.interp(self.spectrum.x, self.draggableScatter.data['x'], self.draggableScatter.data['y'])
-        if hasattr(self, 'interpolated_baseline'):
-            self.plot1.removeItem(self.interpolated_baseline)
-        self.interpolated_baseline = self.plot1.plot(self.spectrum.x, self.baseline_data, pen='g')
+        knots_x = self.draggableScatter.data['x']
+        knots_y = self.draggableScatter.data['y']
+        self.draggableGraph.setData(pos=np.column_stack((knots_x, knots_y)))
+        self.baseline_data = np.interp(self.spectrum.x, knots_x, knots_y)
+        if self.interpolated_baseline.scene() is None:
+            # The plot was cleared (e.g. by undo) since discretizing
+            self.interpolated_baseline = self.plot1.plot(pen='g')
+        self.interpolated_baseline.setData(self.spectrum.x, self.baseline_data)
 
     def discretize_baseline(self):
         # Discretizing the baseline
@@ -404,6 +448,8 @@ class MainApp(QMainWindow):
             self.plot1.removeItem(self.draggableScatter)
         if hasattr(self, 'draggableGraph'):
             self.plot1.removeItem(self.draggableGraph)
+        if hasattr(self, 'interpolated_baseline'):
+            self.plot1.removeItem(self.interpolated_baseline)
 
         # TODO fix color not working... not sure if we need to set bursh or color or symbolBrush or pen or what...
         self.draggableScatter = DraggableScatter(x=x_vals, y=y_vals, size=self.config['discrete baseline point size'], symbolBrush=eval(self.config['discrete baseline point color']))
@@ -411,8 +457,12 @@ class MainApp(QMainWindow):
         self.draggableScatter.dragFinished.connect(self.handle_drag_finished)
         self.draggableGraph = DraggableGraph(scatter_data={'x': x_vals, 'y': y_vals})
         
+        # One curve for the interpolated baseline, filled in by setData as points are dragged
+        self.interpolated_baseline = pg.PlotDataItem(pen='g')
+        
         self.plot1.addItem(self.draggableScatter)
         self.plot1.addItem(self.draggableGraph)
+        self.plot1.addItem(self.interpolated_baseline)
 
         # Replace the smooth baseline with the discretized one
         self.plot1.removeItem(self.baseline_plot)
@@ -426,7 +476,7 @@ class MainApp(QMainWindow):
         name = self.align_button.text()
         if name == 'Align X Axis':
             if self.spectrum.x is not None:
-                lower, upper = min(self.spectrum.x), max(self.spectrum.x)
+                lower, upper = self.spectrum.x.min(), self.spectrum.x.max()
                 self.plot2.setXRange(lower, upper)
                 self.align_button.setText('Reset X Axis')
         else: # Reset case
@@ -436,8 +486,26 @@ class MainApp(QMainWindow):
     def load_database_file(self):
         fname = QFileDialog.getOpenFileName(self, 'Open Database', '..', "Database Files (*.db);;All Files (*)")
         if fname[0]:
-            self.database_path = Path(fname[0])
-            self.database_label.setText(f"Database: {self.database_path.name}")
+            # Check the file and add any missing indexes on a worker thread (slow for a large
+            # catalogue); the app only switches to the database once that succeeds
+            self.load_database_button.setEnabled(False)
+            database_path = Path(fname[0])
+            worker = Worker(prepare_database, database_path)
+            worker.signals.finished.connect(partial(self.database_loaded, database_path))
+            worker.signals.error.connect(self.database_load_failed)
+            QtCore.QThreadPool.globalInstance().start(worker)
+
+    def database_loaded(self, database_path, _):
+        self.load_database_button.setEnabled(True)
+        self.database_path = database_path
+        self.database_label.setText(f"Database: {self.database_path.name}")
+        self.deserialized_spectra = OrderedDict()
+        self.match_results = OrderedDict()
+        self.results_list.clear() # Results name spectra in the previous database
+
+    def database_load_failed(self, error):
+        self.load_database_button.setEnabled(True)
+        QMessageBox.critical(self, 'Error', f'Could not open the database: {error}')
 
     def load_unknown_spectrum(self):
         fname = QFileDialog.getOpenFileName(self, 'Select Raman Spectrum', '..')
@@ -447,13 +515,33 @@ class MainApp(QMainWindow):
             self.command_history.execute(command)
 
     def baseline_callback(self):
+        if not self.button_baseline.isEnabled():
+            return # Baseline estimate is still running
         if self.button_baseline.text() == "Estimate Baseline":
-            command = EstimateBaselineCommand(self, baseline_als(self.spectrum.y))
-            self.command_history.execute(command)
+            # Estimate the baseline on a worker thread so the GUI stays responsive
+            self.button_baseline.setEnabled(False)
+            if self.config.get('baseline downsample', True):
+                worker = Worker(baseline_als_downsampled, self.spectrum.y)
+            else:
+                worker = Worker(baseline_als, self.spectrum.y)
+            worker.signals.finished.connect(partial(self.baseline_estimated, self.spectrum))
+            worker.signals.error.connect(self.baseline_failed)
+            QtCore.QThreadPool.globalInstance().start(worker)
         else:
             command = CorrectBaselineCommand(self)
             self.command_history.execute(command)
 
+    def baseline_estimated(self, spectrum, estimated_baseline):
+        self.button_baseline.setEnabled(True)
+        if spectrum is not self.spectrum:
+            return # Spectrum changed (e.g. undo) while the estimate was running
+        command = EstimateBaselineCommand(self, estimated_baseline)
+        self.command_history.execute(command)
+
+    def baseline_failed(self, error):
+        self.button_baseline.setEnabled(True)
+        QMessageBox.critical(self, 'Error', f'Baseline estimation failed: {error}')
+
     def search_database(self):
         if self.database_label.text() == "Database: None selected":
             # Show an error message
@@ -462,44 +550,67 @@ class MainApp(QMainWindow):
         mineral_name = self.mineral_input.text()
         wavelength = self.wavelength_input.text()
 
-        connection = sqlite3.connect(self.database_path)
-        cursor = connection.cursor()
+        # Search takes place on a worker thread; results are populated when it finishes
+        self.search_button.setEnabled(False)
+        worker = Worker(fetch_spectra_by_name, self.database_path, mineral_name, wavelength)
+        worker.signals.finished.connect(partial(self.populate_search_results, self.database_path))
+        worker.signals.error.connect(self.search_failed)
+        QtCore.QThreadPool.globalInstance().start(worker)
 
-        # Convert the mineral name to lowercase
-        mineral_name_lower = mineral_name.lower()
-
-        # Search takes place in its own thread (not quite working yet)
-        # TODO fix threading
-        if wavelength != '':
-            # Use the LOWER function on names column and = operator for comparison
-            cursor.execute("SELECT filename, data_x, data_y FROM Spectra WHERE LOWER(names) = ? AND wavelength=?", (mineral_name_lower, wavelength))
-        else:
-            cursor.execute("SELECT filename, data_x, data_y FROM Spectra WHERE LOWER(names) = ?", (mineral_name_lower,))
-        results = cursor.fetchall()
+    def populate_search_results(self, database_path, results):
+        self.search_button.setEnabled(True)
+        if database_path != self.database_path:
+            return # Another database was loaded while the search was running
 
         # Populate the results list
+        # Add all rows in one call, with repaints suspended, rather than laying out per row
+        self.results_list.setUpdatesEnabled(False)
         self.results_list.clear()
-        self.data_to_plot = {}
-        for result in results:
-            self.results_list.addItem(result[0])
-            self.data_to_plot[result[0]] = (result[1], result[2])
+        self.results_list.addItems(results)
+        self.results_list.setUpdatesEnabled(True)
 
-        connection.close()  
-        
+    def search_failed(self, error):
+        self.search_button.setEnabled(True)
+        QMessageBox.critical(self, 'Error', f'Database search failed: {error}')
 
     def plot_selected_spectra(self):
         selected_files = [item.text() for item in self.results_list.selectedItems()]
         
-        # Clear previous plots
-        self.plot2.clear()
-
-        for file in selected_files:
-            data_x, data_y = self.data_to_plot[file]
-            x = deserialize(data_x)
-            y = deserialize(data_y)
-            self.plot2.plot(x, y)
-        
+        # Reuse the curves from previous plots (setData is much cheaper than creating and adding
+        # new items); add more only when more files are selected, and blank any left over
+        while len(self.plot2_curves) < len(selected_files):
+            self.plot2_curves.append(self.plot2.plot())
+
+        # Suspend auto-ranging and repaints while setting the curves, then fit the view once
+        view_box = self.plot2.getViewBox()
+        view_box.disableAutoRange()
+        self.plot2.setUpdatesEnabled(False)
+        missing = []
+        try:
+            for curve, file in zip(self.plot2_curves, selected_files):
+                # Only deserialize spectra that have not been plotted recently
+                if file in self.deserialized_spectra:
+                    self.deserialized_spectra.move_to_end(file)
+                else:
+                    row = fetch_spectrum_data(self.database_path, file)
+                    if row is None:
+                        missing.append(file)
+                        curve.clear()
+                        continue
+                    self.deserialized_spectra[file] = (deserialize(row[0]), deserialize(row[1]))
+                    if len(self.deserialized_spectra) > self.config.get('deserialized spectra cache size', 256):
+                        self.deserialized_spectra.popitem(last=False) # Evict the least recently plotted
+                x, y = self.deserialized_spectra[file]
+                curve.setData(x, y)
+            for curve in self.plot2_curves[len(selected_files):]:
+                curve.clear()
+        finally:
+            view_box.enableAutoRange()
+            self.plot2.setUpdatesEnabled(True)
+
         self.plot2.autoRange()
+        if missing:
+            QMessageBox.warning(self, 'Warning', f'Not found in the current database: {", ".join(missing)}')
 
     def toggle_labels_callback(self):
         # Remove any previous text items (assuming you have them stored in a list attribute `self.peak_texts`)
@@ -511,28 +622,30 @@ class MainApp(QMainWindow):
         show = self.button_show_peak_labels.text() == 'Show Labels'
 
         if show:
-            # Create and add the text items to the plot
-            for x, y in zip(self.peaks_x, self.peaks_y):
-                text_item = pg.TextItem(str(round(x, 1)), anchor=(0, 0), color=(255, 0, 0), angle=90)
-                text_item.setPos(x, y)  # Adjusting the y position to be slightly above the peak
+            # Each TextItem is its own graphics item, so only label the tallest peaks;
+            # the markers from find_peaks already show where the rest are
+            shown = np.arange(len(self.peaks_x))
+            if len(shown) > MAX_PEAK_LABELS:
+                shown = np.argpartition(self.peaks_y, -MAX_PEAK_LABELS)[-MAX_PEAK_LABELS:]
+            self.peak_texts = []
+            for i in shown:
+                text_item = pg.TextItem(self.peak_labels[i], anchor=(0, 0), color=(255, 0, 0), angle=90)
+                text_item.setPos(self.peaks_x[i], self.peaks_y[i])  # Adjusting the y position to be slightly above the peak
                 self.plot1.addItem(text_item)
-                if not hasattr(self, 'peak_texts'):
-                    self.peak_texts = []
                 self.peak_texts.append(text_item)
             self.button_show_peak_labels.setText('Hide Labels')
         else:
             self.button_show_peak_labels.setText('Show Labels')
         
     def find_peaks(self):
-        width = self.textbox_width.text()
-        rel_height = self.textbox_rel_height.text()
-        height = self.textbox_height.text()
-        prominence = self.textbox_prominence.text()
-
-        width = eval(width) if width else None
-        rel_height = float(rel_height) if rel_height else None
-        height = float(height) if height else None
-        prominence = float(prominence) if prominence else None
+        try:
+            width = parse_optional_number(self.textbox_width.text(), allow_range=True)
+            rel_height = parse_optional_number(self.textbox_rel_height.text())
+            height = parse_optional_number(self.textbox_height.text())
+            prominence = parse_optional_number(self.textbox_prominence.text())
+        except ValueError:
+            QMessageBox.critical(self, 'Error', 'Peak parameters must be numbers. Width may also be a min,max pair.')
+            return
 
         self.peaks_x, self.peaks_y = get_peaks(
             self.spectrum.x, 
@@ -541,19 +654,23 @@ class MainApp(QMainWindow):
             rel_height=rel_height, 
             height=height, 
             prominence=prominence)
+        # Format the peak labels once here instead of on every label toggle
+        self.peak_labels = np.char.mod('%.1f', self.peaks_x).tolist()
+
+        if hasattr(self, 'peak_plot') and self.peak_plot and self.peak_plot.scene() is not None:
+            # Update the existing peak markers in place instead of re-creating them
+            self.peak_plot.setData(self.peaks_x, self.peaks_y)
+        else:
+            self.peak_plot = self.plot1.plot(self.peaks_x, self.peaks_y, pen=None, symbol='o', symbolSize=7, symbolBrush=(255, 0, 0))
         
-        if hasattr(self, 'peak_plot') and self.peak_plot:
-            self.plot1.removeItem(self.peak_plot)
-            self.peak_plot = None
-        self.peak_plot = self.plot1.plot(self.peaks_x, self.peaks_y, pen=None, symbol='o', symbolSize=7, symbolBrush=(255, 0, 0))
-        
+        # Sort once; the log line and the peaks textbox are built from the same array
         if len(self.peaks_x) < 15:
-            self.plot1_log.addItem(f'Peaks: {", ".join([str(x) for x in sorted(self.peaks_x)])}')
-            self.textbox_peaks.setText(','.join([str(round(x,1)) for x in sorted(self.peaks_x)]))
+            shown_peaks, suffix = np.sort(self.peaks_x), ''
         else:
-            first_15_peaks = self.peaks_x[:15]
-            self.plot1_log.addItem(f'Peaks: {", ".join([str(x) for x in sorted(first_15_peaks)])}...')
-            self.textbox_peaks.setText(','.join([str(round(x,1)) for x in sorted(first_15_peaks)]))
+            # Select the 15 lowest-shift peaks in O(n), then sort only those
+            shown_peaks, suffix = np.sort(np.partition(self.peaks_x, 14)[:15]), '...'
+        self.plot1_log.addItem(f'Peaks: {", ".join([str(x) for x in shown_peaks])}{suffix}')
+        self.textbox_peaks.setText(','.join(np.char.mod('%g', np.round(shown_peaks, 1))))
 
     def on_search(self):
         if self.database_label.text() == "Database: None selected":
@@ -562,31 +679,52 @@ class MainApp(QMainWindow):
             return
     
         # 1. Get values from textboxes
-        peaks = self.textbox_peaks.text().split(',')
-        peaks = [float(x) for x in peaks]
-        tolerance = float(self.textbox_tolerance.text())
+        try:
+            peaks = np.array(self.textbox_peaks.text().split(','), dtype=np.float64) # Parsed in C; raises on bad input
+            tolerance = float(self.textbox_tolerance.text())
+        except ValueError:
+            QMessageBox.critical(self, 'Error', 'Peaks must be comma-separated numbers and tolerance must be a number.')
+            return
+
+        # Repeating a search shows the stored results without touching the database
+        max_order = self.config.get('max combination size', 3)
+        stop_at_lowest_order = self.config.get('stop at lowest order', False)
+        key = (str(self.database_path), tuple(np.unique(peaks).tolist()), tolerance, max_order, stop_at_lowest_order)
+        if key in self.match_results:
+            self.match_results.move_to_end(key)
+            self.populate_match_results(key, self.match_results[key])
+            return
         
-        # 2. Call search function
-        result = find_spectrum_matches(self.database_path, peaks, tolerance) # Dict with keys 1,2,3
-        unqiue_singletons = sorted(get_unique_mineral_combinations_optimized(self.database_path, result[1]))
-        unique_pairs = sorted(get_unique_mineral_combinations_optimized(self.database_path, result[2]))
-        unique_triples = sorted(get_unique_mineral_combinations_optimized(self.database_path, result[3]))
+        # 2. Search on a worker thread; results are populated when it finishes
+        self.button_search.setEnabled(False)
+        worker = Worker(find_unique_mineral_combinations, self.database_path, peaks, tolerance,
+                        max_order=max_order, stop_at_lowest_order=stop_at_lowest_order)
+        worker.signals.finished.connect(partial(self.populate_match_results, key))
+        worker.signals.error.connect(self.match_search_failed)
+        QtCore.QThreadPool.globalInstance().start(worker)
+
+    def populate_match_results(self, key, results):
+        self.button_search.setEnabled(True)
+        if key[0] != str(self.database_path):
+            return # Another database was loaded while the search was running
+        self.match_results[key] = results
+        if len(self.match_results) > 32:
+            self.match_results.popitem(last=False) # Forget the least recent search
+
+        unqiue_singletons, unique_pairs, unique_triples = results
         msg_singletons = f'Found {len(unqiue_singletons)} unique mineral(s) containing your peak(s):\n'
         msg_pairs = f'Found {len(unique_pairs)} unique combinations of 2 minerals matching your peak(s):\n'
         msg_triples = f'Found {len(unique_triples)} unique combinations of 3 minerals matching your peak(s):\n'
         
-        # 3. Populate the QTextEdits with the results:
-        self.result_single.setText(msg_singletons)
-        self.result_double.setText(msg_pairs)
-        self.result_triple.setText(msg_triples)
-
-        for line in unqiue_singletons:
-            self.result_single.append(line[0])
-        for line in unique_pairs:
-            self.result_double.append(f'{line[0]},   {line[1]}')
-        for line in unique_triples:
-            self.result_triple.append(f'{line[0]},   {line[1]},   {line[2]}')
-
+        # 3. Populate the QTextEdits with the results (one setPlainText each, rather than one append per line):
+        for text_edit, msg, combos in ((self.result_single, msg_singletons, unqiue_singletons),
+                                       (self.result_double, msg_pairs, unique_pairs),
+                                       (self.result_triple, msg_triples, unique_triples)):
+            text_edit.setPlainText('\n'.join([msg] + [',   '.join(map(str, combo)) for combo in combos]))
+
+    def match_search_failed(self, error):
+        self.button_search.setEnabled(True)
+        QMessageBox.critical(self, 'Error', f'Search failed: {error}')
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
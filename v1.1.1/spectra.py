@@ -4,36 +4,69 @@ import numpy as np
 
 class Spectrum:
     def __init__(self, x, y):
-        self.x = np.array(x)
-        self.y = np.array(y)
-        self._history = [(x.copy(), y.copy())]
-        self._current = 0
+        # Contiguous float64 so the arithmetic in _apply hits NumPy's vectorized loops
+        self.x = np.array(x, dtype=np.float64)
+        self.y = np.array(y, dtype=np.float64)
+        # History is a log of operations replayed from the original data, rather than
+        # a full copy of x and y after every edit. Operations never modify arrays in
+        # place, so the original data and any cached state can be shared safely.
+        self._base = (self.x, self.y)
+        self._history = [] # ('baseline', baseline) or ('crop', start, end)
+        self._current = 0 # Number of operations from the log currently applied
+        self._cached_state = (0, self.x, self.y)
 
     def correct_baseline(self, baseline):
-        self.y -= baseline
-        self._add_to_history()
+        baseline = np.ascontiguousarray(baseline, dtype=np.float64)
+        if baseline.shape != self.y.shape:
+            raise ValueError(f'Baseline shape {baseline.shape} does not match spectrum shape {self.y.shape}')
+        self.x, self.y = self._apply(('baseline', baseline), self.x, self.y)
+        self._add_to_history(('baseline', baseline))
 
     def crop(self, start, end):
-        mask = (self.x >= start) & (self.x <= end)
-        self.x = self.x[mask]
-        self.y = self.y[mask]
-        self._add_to_history()
-    
+        self.x, self.y = self._apply(('crop', start, end), self.x, self.y)
+        self._add_to_history(('crop', start, end))
+
     def undo(self):
         if self._current > 0:
             self._current -= 1
             self._restore()
 
     def redo(self):
-        if self._current < len(self._history) - 1:
+        if self._current < len(self._history):
             self._current += 1
             self._restore()
 
-    def _add_to_history(self):
+    def _add_to_history(self, operation):
         # Remove any redo data beyond the current pointer
-        self._history = self._history[:self._current+1]
-        self._history.append((self.x.copy(), self.y.copy()))
-        self._current = len(self._history) - 1
+        del self._history[self._current:]
+        self._history.append(operation)
+        self._current = len(self._history)
+        self._cached_state = (self._current, self.x, self.y)
+
+    @staticmethod
+    def _apply(operation, x, y):
+        """Returns new (x, y) arrays with `operation` applied"""
+        if operation[0] == 'baseline':
+            return x, y - operation[1]
+        else:
+            _, start, end = operation
+            if len(x) and x[0] > x[-1]:
+                # Descending x; fall back to a mask
+                mask = (x >= start) & (x <= end)
+                return x[mask], y[mask]
+            # x is sorted, so the crop is one contiguous slice found by binary search. The
+            # slices are views, which is safe since operations never write into arrays
+            lo = np.searchsorted(x, start)
+            hi = np.searchsorted(x, end, side='right')
+            return x[lo:hi], y[lo:hi]
 
     def _restore(self):
-        self.x, self.y = self._history[self._current]
\ No newline at end of file
+        # Replay from the most recently materialized state when moving forward (redo),
+        # otherwise from the original data
+        cached_index, x, y = self._cached_state
+        if cached_index > self._current:
+            cached_index, (x, y) = 0, self._base
+        for operation in self._history[cached_index:self._current]:
+            x, y = self._apply(operation, x, y)
+        self.x, self.y = x, y
+        self._cached_state = (self._current, x, y)
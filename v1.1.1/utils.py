@@ -1,59 +1,114 @@
 """Utility functions for raman mineral identification"""
 
-from itertools import combinations
+import ast
+import json
+import os
+from pathlib import Path
+from functools import lru_cache
+from collections import Counter
+from itertools import chain, combinations
 
 import sqlite3
 from tqdm import tqdm
 import pandas as pd
 
 import numpy as np
-from scipy.sparse import csc_matrix, eye, diags
-from scipy.sparse.linalg import spsolve
+from scipy.linalg import solveh_banded
 from scipy.signal import find_peaks
 
+_connections = {} # Shared connections, by database path
+
+def get_connection(database_path):
+    """Returns the shared, open connection to `database_path`
+
+    Connections are opened once per database and reused by every query, so searches
+    don't pay for reconnecting and SQLite's page cache stays warm between them. They are
+    read-only (only the temp table used by searches can be written), so a search never
+    takes a write lock on the database; prepare_database uses its own connection.
+    """
+    database_path = str(database_path)
+    if database_path not in _connections:
+        # Shared with the GUI's worker threads; each query uses its own cursor
+        uri = Path(database_path).resolve().as_uri() + '?mode=ro'
+        connection = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        connection.execute("PRAGMA cache_size = -65536") # 64 MiB page cache (default is 2 MiB)
+        connection.execute("PRAGMA temp_store = MEMORY") # Keep the unknown_peak_ranges table off disk
+        connection.execute("PRAGMA mmap_size = 268435456") # Read up to 256 MiB of the file through memory mapping
+        _connections[database_path] = connection
+    return _connections[database_path]
+
+def close_connections():
+    """Closes every shared connection opened by get_connection"""
+    for connection in _connections.values():
+        connection.close()
+    _connections.clear()
+
+# Indexes the searches rely on, by name; prepare_database creates any that are missing
+INDEXES = {
+    'idx_spectra_strongest_peak': 'Spectra(strongest_peak)', # fetch_filename_and_peaks_filtered
+    'idx_spectra_names_nocase': 'Spectra(names COLLATE NOCASE, wavelength)', # fetch_spectra_by_name
+    'idx_spectra_filename': 'Spectra(filename)', # fetch_spectrum_data
+}
+
+def prepare_database(database_path):
+    """Adds the indexes searches rely on to the database at `database_path`, if they are missing
+
+    Databases that can't be written to (read-only files, locked databases) are left as they
+    are; searches still work without the indexes, just with table scans. The shared
+    connections from get_connection are read-only, so this opens a writable one of its own.
+
+    Raises sqlite3.DatabaseError if the file is not a SQLite database with a Spectra table.
+    """
+    connection = sqlite3.connect(database_path)
+    try:
+        schema = connection.execute("SELECT type, name FROM sqlite_master").fetchall()
+        if ('table', 'Spectra') not in schema:
+            raise sqlite3.DatabaseError('no Spectra table')
+        existing = {name for kind, name in schema if kind == 'index'}
+        missing = [name for name in INDEXES if name not in existing]
+        if missing:
+            for name in missing:
+                connection.execute(f"CREATE INDEX {name} ON {INDEXES[name]}")
+            connection.execute("ANALYZE")
+            connection.commit()
+    except sqlite3.OperationalError:
+        connection.rollback()
+    finally:
+        connection.close()
+
 def fetch_filename_and_peaks_filtered(database_path, peaks_set, tol):
-    """Like filter_spectra_byinclusion but returns peaks as well"""
-    conn = sqlite3.connect(database_path)
-    cursor = conn.cursor()
-    
-    # Create the inclusion criteria for each peak in the set
-    inclusion_conditions = []
-    for peak in peaks_set:
-        condition = "(strongest_peak >= ? AND strongest_peak <= ?)"
-        inclusion_conditions.append((condition, peak - tol, peak + tol))
-    
-    # Build the SQL query
-    query_conditions = " OR ".join([cond[0] for cond in inclusion_conditions])
-    query_values = [val for cond in inclusion_conditions for val in cond[1:]]
-    query = f"""
+    """Like filter_spectra_byinclusion but returns peaks as well
+
+    The (peak - tol, peak + tol) ranges are loaded into a temporary table and joined against
+    strongest_peak, instead of building an OR clause (and two parameters) per peak. With the
+    index from prepare_database each range is an index range search rather than a table scan.
+    """
+    connection = get_connection(database_path)
+    cursor = connection.cursor()
+
+    # Load the inclusion ranges for each peak in the set
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS unknown_peak_ranges (lo REAL, hi REAL)")
+    cursor.execute("DELETE FROM unknown_peak_ranges")
+    cursor.executemany("INSERT INTO unknown_peak_ranges VALUES (?, ?)", [(peak - tol, peak + tol) for peak in peaks_set])
+    connection.commit() # Don't leave a transaction (and read lock) open on the shared connection
+
+    # Each spectrum is returned once, even if it falls in several overlapping ranges
+    query = """
     SELECT filename, peaks
     FROM Spectra
-    WHERE {query_conditions};
+    WHERE rowid IN (
+        SELECT Spectra.rowid
+        FROM unknown_peak_ranges JOIN Spectra ON strongest_peak BETWEEN lo AND hi
+    );
     """
     
     # Execute the SQL query
-    cursor.execute(query, query_values)
+    cursor.execute(query)
     matching_rows = cursor.fetchall()
     
-    conn.close()
-    
     return matching_rows
 
-def peaks_within_tolerance(known_peaks, unknown_peak, tol):
-    """Check if the unknown peak is within tolerance of any of the known peaks."""
-    for peak in known_peaks:
-        if abs(peak - unknown_peak) <= tol:
-            return True
-    return False
-
-def check_peak_superset(db_peaks, unknown_peaks, tol):
-    """Check if db_peaks is a superset of unknown_peaks (within the given tolerance)."""
-    for peak in unknown_peaks:
-        if not peaks_within_tolerance(db_peaks, peak, tol):
-            return False
-    return True
-
-def find_spectrum_matches(database_path, unknown_peaks, tol):
+def find_spectrum_matches(database_path, unknown_peaks, tol, max_order=3, stop_at_lowest_order=False):
     """
     Find potential mineral combinations in the database that match the unknown spectrum.
     
@@ -61,44 +116,201 @@ def find_spectrum_matches(database_path, unknown_peaks, tol):
     - database_path: path to the SQLite database
     - unknown_peaks: list of peaks from the unknown spectrum
     - tol: the tolerance
+    - max_order: the largest combination size searched (1 to 3); larger sizes are left empty
+    - stop_at_lowest_order: skip larger combinations once a smaller size has any match. Adding
+      a spectrum to a match always gives another match, so these are mostly redundant
     
     Returns:
     - List of combinations (filename sets) that match the unknown spectrum
     """
-    
     rows = fetch_filename_and_peaks_filtered(database_path, unknown_peaks, tol)
+    return _find_spectrum_matches(rows, unknown_peaks, tol, max_order, stop_at_lowest_order)
+
+def _expand_group_combo(members, group_combo):
+    """Row-index array (one sorted row per combination) of every way to draw the groups in `group_combo` (repeats allowed) from `members`"""
+    expanded = np.zeros((1, 0), dtype=np.intp)
+    for group, count in Counter(group_combo).items():
+        picks = np.array(list(combinations(members[group], count)), dtype=np.intp).reshape(-1, count)
+        expanded = np.hstack([np.repeat(expanded, len(picks), axis=0), np.tile(picks, (len(expanded), 1))])
+    return np.sort(expanded, axis=1)
+
+def _expand_distinct_group_combos(rows_by_group, group_sizes, group_combos):
+    """Row-index array (one sorted row per combination) of every way to draw one member from each
+    group in each row of `group_combos`, for rows with no repeated group
+
+    `rows_by_group` lists the members of group 0, then group 1 and so on. Each output row is
+    found by reading its position within its combination as a mixed-radix number, one digit
+    per group.
+    """
+    sizes = group_sizes[group_combos]
+    counts = sizes.prod(axis=1)
+    source = np.repeat(np.arange(len(group_combos)), counts)
+    position = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    radix = np.cumprod(sizes[:, ::-1], axis=1)[:, ::-1] // sizes # Product of the later sizes
+    digits = position[:, None] // radix[source] % sizes[source]
+    first = (np.cumsum(group_sizes) - group_sizes)[group_combos[source]]
+    return np.sort(rows_by_group[first + digits], axis=1)
+
+def _find_spectrum_matches(rows, unknown_peaks, tol, max_order, stop_at_lowest_order):
+    """Search behind find_spectrum_matches over the candidate (filename, peaks) `rows`"""
     filenames = [row[0] for row in rows]
-    db_peak_sets = [set(eval(row[1])) for row in rows]
-    
-    potential_matches = {1: [], 2: [], 3: []}
-    
-    # Check singles, pairs, and triples
-    for r in range(1, 4):
-        for combo_indices in tqdm(combinations(range(len(filenames)), r)):
-            combined_peaks = set().union(*[db_peak_sets[i] for i in combo_indices])
-            if check_peak_superset(combined_peaks, unknown_peaks, tol):
-                potential_matches[r].append([filenames[i] for i in combo_indices])
-    
+    all_peaks, peak_counts = parse_number_lists([row[1] for row in rows])
+
+    # Coverage matrix: covered[i, k] is True when spectrum i has a peak within tol of unknown
+    # peak k. A combination of spectra matches when the OR of their rows is all True, which
+    # is the same as every unknown peak being within tol of a peak in one of the spectra.
+    unknown = np.array(unknown_peaks, dtype=float)
+    row_of_peak = np.repeat(np.arange(len(rows)), peak_counts)
+    peak_hits, unknown_hits = np.nonzero(np.abs(all_peaks[:, None] - unknown[None, :]) <= tol)
+    covered = np.zeros((len(rows), len(unknown)), dtype=bool)
+    covered[row_of_peak[peak_hits], unknown_hits] = True
+
+    # Candidates with identical coverage rows are interchangeable, so search over the distinct
+    # rows ("groups") and expand each matching group combination back into spectra afterwards.
+    # A group can appear more than once in a combination if it has enough members.
+    groups, group_of_row = np.unique(covered, axis=0, return_inverse=True)
+    group_of_row = group_of_row.ravel()
+    group_sizes = np.bincount(group_of_row, minlength=len(groups))
+    rows_by_group = np.argsort(group_of_row, kind='stable')
+    members = np.split(rows_by_group, np.cumsum(group_sizes)[:-1])
+
+    # Pack each coverage row into 64-bit words (bit k set when unknown peak k is covered), so
+    # combining rows is a bitwise OR of a word or two and "covers everything" is a comparison
+    # with the all-ones mask, instead of OR-ing and reducing K booleans
+    def pack(rows):
+        packed = np.zeros((len(rows), 8 * max(1, -(-len(unknown) // 64))), dtype=np.uint8)
+        packed[:, :-(-len(unknown) // 8)] = np.packbits(rows, axis=1)
+        return packed.view(np.uint64)
+    group_masks = pack(groups)
+    full_mask = pack(np.ones((1, len(unknown)), dtype=bool))
+
+    # Every match has a member covering the unknown peak that the fewest groups cover, so only
+    # those "anchor" groups are tried as the member that covers it. Each combination is built
+    # from its lowest anchor only (other members may cover the rare peak too, but only if they
+    # come later), so none is found twice
+    is_anchor = groups[:, np.argmin(groups.sum(axis=0))] if len(unknown) else np.ones(len(groups), dtype=bool)
+    anchors = np.flatnonzero(is_anchor)
+    group_ids = np.arange(len(groups))
+
+    def after_anchor(x, g):
+        return ~is_anchor[g] | (g >= x)
+
+    def enough_members(combos):
+        """Whether each row of groups draws no group more times than it has members"""
+        counts = (combos[:, :, None] == combos[:, None, :]).sum(axis=2)
+        return (group_sizes[combos] >= counts).all(axis=1)
+
+    group_combos = {r: np.empty((0, r), dtype=np.intp) for r in (1, 2, 3)}
+
+    def search(r):
+        """Whether combinations of size r are searched at all"""
+        return r <= max_order and not (stop_at_lowest_order and any(len(group_combos[s]) for s in range(1, r)))
+
+    # Singles
+    if search(1):
+        group_combos[1] = anchors[(group_masks[anchors] == full_mask).all(axis=1)][:, None]
+
+    # Pairs: an anchor and any other group, all at once
+    if search(2):
+        x, y = np.repeat(anchors, len(groups)), np.tile(group_ids, len(anchors))
+        pairs = np.sort(np.column_stack((x, y)), axis=1)
+        ok = ((group_masks[x] | group_masks[y]) == full_mask).all(axis=1) & after_anchor(x, y)
+        pairs = pairs[ok]
+        group_combos[2] = pairs[enough_members(pairs)]
+
+    # Triples: for each anchor, OR its mask into every pair (b, c) with b <= c
+    if search(3):
+        pair_b, pair_c = np.triu_indices(len(groups))
+        pair_masks = group_masks[pair_b] | group_masks[pair_c]
+        triples = []
+        for x in tqdm(anchors):
+            h = np.flatnonzero(((group_masks[x] | pair_masks) == full_mask).all(axis=1) & after_anchor(x, pair_b) & after_anchor(x, pair_c))
+            triples.append(np.column_stack((np.full(len(h), x), pair_b[h], pair_c[h])))
+        triples = np.sort(np.concatenate(triples + [np.empty((0, 3), dtype=np.intp)]), axis=1)
+        group_combos[3] = triples[enough_members(triples)]
+
+    # Expand back to filenames, in the same order as itertools.combinations over the rows.
+    # Combinations of distinct groups (the common case) are expanded all at once; ones that
+    # draw a group more than once are expanded one at a time
+    filenames = np.array(filenames, dtype=object)
+    potential_matches = {}
+    for r, combos in group_combos.items():
+        distinct = (np.diff(combos, axis=1) != 0).all(axis=1) # Rows are sorted
+        expanded = np.concatenate([_expand_distinct_group_combos(rows_by_group, group_sizes, combos[distinct])]
+                                  + [_expand_group_combo(members, combo) for combo in combos[~distinct]])
+        expanded = expanded[np.lexsort(expanded.T[::-1])]
+        potential_matches[r] = filenames[expanded].tolist()
+
     return potential_matches
 
 def get_unique_mineral_combinations_optimized(database_path, combos):
-    conn = sqlite3.connect(database_path)
-    cursor = conn.cursor()
+    names, filename_to_code = _mineral_name_codes(str(database_path), os.path.getmtime(database_path))
+    if not combos:
+        return set()
+
+    # Lookup mineral codes for the filenames in all combos at once (combos all have the same
+    # size) and sort each row
+    combo_size = len(combos[0])
+    codes = np.fromiter(map(filename_to_code.__getitem__, chain.from_iterable(combos)), dtype=np.intp, count=len(combos) * combo_size)
+    codes = np.sort(codes.reshape(-1, combo_size), axis=1)
+
+    # Deduplicate rows as single integers (each row read as a base-len(names) number), which
+    # is much faster than np.unique over rows
+    shape = (len(names),) * combo_size
+    unique_codes = np.column_stack(np.unravel_index(np.unique(np.ravel_multi_index(codes.T, shape)), shape))
+
+    names = np.array(names, dtype=object)
+    return set(map(tuple, names[unique_codes].tolist()))
+
+@lru_cache(maxsize=4)
+def _mineral_name_codes(database_path, mtime):
+    """Returns (names, filename_to_code) for every spectrum in the database
+
+    Cached per database file and modification time, so the table is only scanned once
+    rather than on every call (on_search calls get_unique_mineral_combinations_optimized
+    three times per search). The returned objects are shared and must not be modified.
+    """
+    cursor = get_connection(database_path).cursor()
     
     # Fetch all filenames and their corresponding names from the Spectra table
     cursor.execute("SELECT filename, names FROM Spectra")
     filename_to_name = dict(cursor.fetchall())
-    
-    unique_combos = set()
-    
-    for combo in combos:
-        # Lookup mineral names for the filenames in the combo using the in-memory dictionary
-        names = [filename_to_name[filename] for filename in combo]
-        names = tuple(sorted(names))
-        unique_combos.add(names)
-    
-    conn.close()
-    return unique_combos
+
+    # Give each distinct mineral name an integer code in sorted-name order, so combos can be
+    # deduplicated as small int tuples and sorting codes is the same as sorting names
+    names = sorted(set(filename_to_name.values()), key=str)
+    name_to_code = {name: code for code, name in enumerate(names)}
+    filename_to_code = {filename: name_to_code[name] for filename, name in filename_to_name.items()}
+    return names, filename_to_code
+
+def find_unique_mineral_combinations(database_path, unknown_peaks, tol, max_order=3, stop_at_lowest_order=False):
+    """Returns sorted lists of the unique mineral singles, pairs and triples matching `unknown_peaks`
+    (see find_spectrum_matches for `max_order` and `stop_at_lowest_order`)"""
+    matches = find_spectrum_matches(database_path, unknown_peaks, tol, max_order, stop_at_lowest_order) # Dict with keys 1,2,3
+    return tuple(sorted(get_unique_mineral_combinations_optimized(database_path, matches[r])) for r in (1, 2, 3))
+
+def fetch_spectra_by_name(database_path, mineral_name, wavelength=''):
+    """Returns the filenames of spectra whose mineral name matches (case-insensitive)
+
+    Only the filenames are read; the spectrum data is fetched with `fetch_spectrum_data`
+    once a spectrum is actually plotted.
+    """
+    cursor = get_connection(database_path).cursor()
+
+    if wavelength != '':
+        # Compare with the NOCASE collation rather than LOWER(names), so the index can be used
+        cursor.execute("SELECT filename FROM Spectra WHERE names = ? COLLATE NOCASE AND wavelength = ?", (mineral_name, wavelength))
+    else:
+        cursor.execute("SELECT filename FROM Spectra WHERE names = ? COLLATE NOCASE", (mineral_name,))
+    results = [row[0] for row in cursor.fetchall()]
+
+    return results
+
+def fetch_spectrum_data(database_path, filename):
+    """Returns the serialized (data_x, data_y) of the spectrum stored as `filename`"""
+    cursor = get_connection(database_path).cursor()
+    cursor.execute("SELECT data_x, data_y FROM Spectra WHERE filename = ? LIMIT 1", (filename,))
+    return cursor.fetchone()
 
 def get_lines(file):
     with open(file, 'r') as f:
@@ -113,66 +325,160 @@ def axis_to_number(axis):
     else:
         raise ValueError('Please enter x or y for `axis` parameter')
 
-def get_data(file, axis='x'):
-    # Extract data (x or y) from a .txt spectrum file
+def read_columns(file, columns):
+    """Parses the given columns of a .txt spectrum file, reading it only once
 
-    n = axis_to_number(axis)
-    
-    data = []
+    Returns one float array per column, in ascending x order (whitespace-separated files are
+    stored descending, so they are reversed).
+    """
     lines = get_lines(file)
     first_line = lines[0]
-    if first_line.startswith('#'):
-        for line in lines:
-            if not line.startswith('##') and line.strip() and not line.startswith('800, -'):
-                data += [float(line.split(', ')[n])]
-        return data
+    if first_line.startswith('#'): # RRUFF format
+        lines = [line for line in lines if not line.startswith('##') and line.strip() and not line.startswith('800, -')]
+        delimiter, split, reverse = ',', lambda line: line.split(', '), False
     else: # Assume whitespace-separated
-        for line in lines:
-            line = line.strip()
-            if line:
-                data += [float(line.split()[n])]
-        return data[::-1]
+        delimiter, split, reverse = None, str.split, True
+    try:
+        # Parse the numbers in C rather than one float() per line
+        data = np.loadtxt(lines, delimiter=delimiter, usecols=columns, comments=None, ndmin=2)
+    except ValueError:
+        # Irregular rows; fall back to splitting each line, straight into presized arrays
+        rows = [split(line) for line in lines if line.strip()]
+        data = np.column_stack([np.fromiter((float(row[n]) for row in rows), dtype=np.float64, count=len(rows)) for n in columns])
+    if reverse:
+        data = data[::-1]
+    return tuple(data.T)
 
+def get_data(file, axis='x'):
+    # Extract data (x or y) from a .txt spectrum file
+    return read_columns(file, (axis_to_number(axis),))[0]
+
+def get_xy_data(file):
+    """Extracts x and y from a .txt spectrum file in a single pass"""
+    return read_columns(file, (0, 1))
 
 def get_xy_from_file(file):
     if file.name.endswith('.txt'):
         try:
-            x = get_data(file, axis='x')
-            y = get_data(file, axis='y')
+            x, y = get_xy_data(file)
         except:
             raise ValueError(f'Could not extract x and y from {file}. Ensure format matches RRUFF .txt file format.')
-        return np.array(x), np.array(y)
+        # Columns of the parsed table are strided views; give callers contiguous arrays
+        return np.ascontiguousarray(x), np.ascontiguousarray(y)
     elif file.name.endswith('.csv'):
         # TODO add error handling
         df = pd.read_csv(file)
         if 'x' in df.columns and 'y' in df.columns: # TODO Make this more flexible
-            return np.array(df['x']), np.array(df['y'])
+            return df['x'].to_numpy(), df['y'].to_numpy()
         
+def parse_literal(text):
+    """Parses a list stored as text in the database, e.g. '[1.0, 2.5]', without eval
+
+    json.loads handles the usual str(list) output quickly in C; anything else (tuples etc.)
+    falls back to ast.literal_eval, which only accepts literals.
+    """
+    try:
+        return json.loads(text)
+    except ValueError:
+        return ast.literal_eval(text)
+
+def parse_number_lists(texts):
+    """Parses lists of numbers stored as text, e.g. '[1.0, 2.5]', into one flat float array
+    plus the length of each list
+
+    The brackets are stripped and the lists joined, so np.fromstring reads every number in a
+    single C pass. If that doesn't give exactly the expected count (unusual literals), each
+    text goes through parse_literal instead. Only flat lists are supported; a nested list
+    raises ValueError.
+    """
+    bodies = [text.strip().strip('[](){}') for text in texts]
+    counts = np.array([body.count(',') + 1 if body.strip() else 0 for body in bodies], dtype=np.intp)
+    try:
+        values = np.fromstring(','.join(body for body in bodies if body.strip()), sep=',')
+        if len(values) == counts.sum():
+            return values, counts
+    except ValueError:
+        pass
+    lists = [list(parse_literal(text)) for text in texts]
+    return np.fromiter(chain.from_iterable(lists), dtype=float), np.array([len(values) for values in lists], dtype=np.intp)
+
 def deserialize(vec):
-    return np.array(eval(vec))
+    try:
+        return parse_number_lists([vec])[0]
+    except (TypeError, ValueError): # Nested lists
+        return np.array(parse_literal(vec))
 
-def baseline_als(y, lam=1e5, p=0.05, niter=1000):
+@lru_cache(maxsize=8)
+def _penalty_bands(L, lam):
+    """The smoothness penalty lam * D D^T of `baseline_als` (D the L x (L-2) second-difference
+    matrix) in upper banded form for solveh_banded
+
+    W + lam * D D^T is symmetric pentadiagonal, so it is solved as a banded system instead of a
+    general sparse one. Row 2 is the main diagonal, rows 1 and 0 the first and second
+    superdiagonals (left-padded). The diagonals are written down directly rather than
+    multiplying out D. Cached, since spectra of the same length are often re-estimated with
+    the same lam; the returned array is read-only.
+    """
+    bands = np.zeros((3, L))
+    bands[2, :-2] += 1 # Each column of D is (1, -2, 1) down rows j, j+1, j+2
+    bands[2, 1:-1] += 4
+    bands[2, 2:] += 1
+    bands[1, 1:-1] -= 2
+    bands[1, 2:] -= 2
+    bands[0, 2:] = 1
+    bands *= lam
+    bands.flags.writeable = False
+    return bands
+
+def baseline_als(y, lam=1e5, p=0.05, niter=1000, tol=1e-3):
+    """Asymmetric least squares baseline of `y` (NaNs are ignored and kept in the output)
+
+    Iterates at most `niter` times, stopping early once no weight changes by `tol` or more.
+    The weights only take the values 0, p and 1-p, so once they stop changing every further
+    iteration would return the same baseline.
+    """
     L = len(y)
     valid_indices = ~np.isnan(y)
     y_valid = y[valid_indices]
     
     L_valid = len(y_valid)  # Length of valid y values
-    D = diags([1, -2, 1], [0, -1, -2], shape=(L_valid, L_valid-2))
-    D = lam * D.dot(D.transpose())
+    D_bands = _penalty_bands(L_valid, lam)
     w = np.ones(L_valid)
-    W = diags([w], [0], shape=(L_valid, L_valid))
+    ab = np.empty_like(D_bands) # Refilled every iteration, since the solver overwrites it
     
     for i in range(niter):
-        W.setdiag(w)
-        Z = W + D
-        z_valid = spsolve(csc_matrix(Z), w*y_valid)
+        # Only the main diagonal depends on the weights
+        ab[:2] = D_bands[:2]
+        np.add(D_bands[2], w, out=ab[2])
+        z_valid = solveh_banded(ab, w*y_valid, overwrite_ab=True, overwrite_b=True, check_finite=False)
+        w_prev = w
         w = p * (y_valid > z_valid) + (1-p) * (y_valid < z_valid)
+        if np.max(np.abs(w - w_prev)) < tol:
+            break
     
     z = np.empty_like(y)
     z[:] = np.nan
     z[valid_indices] = z_valid
     return z
 
+def baseline_als_downsampled(y, max_points=1024, lam=1e5, **kwargs):
+    """`baseline_als` solved on at most about `max_points` evenly strided samples of `y`,
+    then linearly interpolated back to every sample
+
+    The baseline is smooth by construction, so it survives the downsampling. `lam` is scaled
+    by stride**4 so the second-difference penalty stays equivalent on the coarser grid. Like
+    `baseline_als`, it works in sample-index space, so the order of the x values doesn't matter.
+    """
+    stride = max(1, len(y) // max_points)
+    if stride == 1:
+        return baseline_als(y, lam=lam, **kwargs)
+    index = np.arange(len(y))
+    z_ds = baseline_als(y[::stride], lam=lam / stride**4, **kwargs)
+    valid = ~np.isnan(z_ds)
+    z = np.interp(index, index[::stride][valid], z_ds[valid])
+    z[np.isnan(y)] = np.nan
+    return z
+
 def get_peaks(x, y, width, rel_height, height, prominence):
     peaks, _ = find_peaks(y, width=width, rel_height=rel_height, height=height, prominence=prominence)
     return x[peaks], y[peaks]
\ No newline at end of file
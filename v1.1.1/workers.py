@@ -0,0 +1,32 @@
+"""This module contains a QRunnable wrapper for running slow calls off the GUI thread
+
+Results are delivered back through Qt signals, so slots connected to them run on the
+GUI thread and can safely update widgets.
+"""
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+
+class WorkerSignals(QObject):
+    """Signals for Worker (QRunnable is not a QObject, so it cannot define signals itself)"""
+    finished = pyqtSignal(object)
+    error = pyqtSignal(Exception)
+
+
+
+class Worker(QRunnable):
+    """Runs `fn(*args, **kwargs)` on a QThreadPool thread and emits the return value"""
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.error.emit(e)
+        else:
+            self.signals.finished.emit(result)